@@ -1,13 +1,13 @@
 """Used in logging colorized handler"""
 
-import platform
 import sys
-from contextlib import contextmanager
+
+IS_WINDOWS = sys.platform.startswith('win')
 
 #
 # use colorama wrappers around python stdlib ctypes on Windows
 #
-if 'Win' in platform.system():
+if IS_WINDOWS:
     import colorama
     colorama.just_fix_windows_console()
     from colorama.win32 import STDERR, STDOUT, GetConsoleScreenBufferInfo
@@ -77,68 +77,67 @@ ANSI_NORMAL = '\x1b[0m'
 ANSI_CLEAR = '\x1b[m'
 
 
+# color per level bucket (levelno // 10), NOTSET .. CRITICAL and above
+_WINDOWS_BY_LEVEL = (
+    FOREGROUND_WHITE,
+    FOREGROUND_MAGENTA,
+    FOREGROUND_GREEN,
+    FOREGROUND_YELLOW | FOREGROUND_INTENSITY,
+    FOREGROUND_RED | FOREGROUND_INTENSITY,
+    BACKGROUND_YELLOW | FOREGROUND_RED | FOREGROUND_INTENSITY | BACKGROUND_INTENSITY,
+    )
+_ANSI_BY_LEVEL = (ANSI_NORMAL, ANSI_PINK, ANSI_GREEN, ANSI_YELLOW, ANSI_RED, ANSI_RED)
+_MAX_LEVEL = len(_ANSI_BY_LEVEL) - 1
+
+
 def choose_color_windows(levelno):
-    if levelno >= 50:
-        color = BACKGROUND_YELLOW | FOREGROUND_RED | FOREGROUND_INTENSITY | BACKGROUND_INTENSITY
-    elif levelno >= 40:
-        color = FOREGROUND_RED | FOREGROUND_INTENSITY
-    elif levelno >= 30:
-        color = FOREGROUND_YELLOW | FOREGROUND_INTENSITY
-    elif levelno >= 20:
-        color = FOREGROUND_GREEN
-    elif levelno >= 10:
-        color = FOREGROUND_MAGENTA
-    else:
-        color = FOREGROUND_WHITE
-    return color
+    return _WINDOWS_BY_LEVEL[min(max(levelno, 0) // 10, _MAX_LEVEL)]
 
 
 def choose_color_ansi(levelno):
-    if levelno >= 50:
-        color = ANSI_RED
-    elif levelno >= 40:
-        color = ANSI_RED
-    elif levelno >= 30:
-        color = ANSI_YELLOW
-    elif levelno >= 20:
-        color = ANSI_GREEN
-    elif levelno >= 10:
-        color = ANSI_PINK
-    else:
-        color = ANSI_NORMAL
-    return color
-
-
-@contextmanager
-def set_color(color, stream=sys.stdout):
-    """Set the color on the stream temporarily; only necessary on Windows"""
-    if 'Win' in platform.system():
-        handle = NT_CONSOLE_HANDLE[stream.fileno()]
-        default = GetConsoleScreenBufferInfo(handle).wAttributes
-        try:
-            SetConsoleTextAttribute(handle, color)
-            yield
-        finally:
-            SetConsoleTextAttribute(handle, default)
-    else:
-        try:
-            stream.write(color)
-            yield
-        except:
-            stream.write(ANSI_CLEAR)
-            raise
-        finally:
-            stream.write(ANSI_CLEAR)
+    return _ANSI_BY_LEVEL[min(max(levelno, 0) // 10, _MAX_LEVEL)]
+
+
+class set_color:
+    """Set the color on the stream temporarily; only necessary on Windows
+    a plain context manager class, entered once per colored emit
+    """
+    __slots__ = ('color', 'stream', '_handle', '_default')
+
+    def __init__(self, color, stream=sys.stdout):
+        self.color = color
+        self.stream = stream
+
+    def __enter__(self):
+        if IS_WINDOWS:
+            self._handle = NT_CONSOLE_HANDLE[self.stream.fileno()]
+            self._default = GetConsoleScreenBufferInfo(self._handle).wAttributes
+            SetConsoleTextAttribute(self._handle, self.color)
+        else:
+            self.stream.write(self.color)
+        return self
+
+    def __exit__(self, *exc_info):
+        if IS_WINDOWS:
+            SetConsoleTextAttribute(self._handle, self._default)
+        else:
+            self.stream.write(ANSI_CLEAR)
+        return False
 
 
 def write_color(color, message, stream=sys.stdout):
-    """Just a clean DRY way to write stream and the close"""
-    with set_color(color, stream):
-        stream.write(message)
+    """Just a clean DRY way to write stream and the close
+    one write with the ansi codes around the message
+    """
+    if IS_WINDOWS:
+        with set_color(color, stream):
+            stream.write(message)
+    else:
+        stream.write(f'{color}{message}{ANSI_CLEAR}')
 
 
 if __name__ == '__main__':
-    if 'Win' in platform.system():
+    if IS_WINDOWS:
         for k in range(256):
             write_color(k, f'This is color {k}. How does it look?\n')
         print('Auto-reset!')
@@ -1,6 +1,6 @@
 import os
 import tempfile
-from pathlib import Path
+from functools import lru_cache
 
 from libb import Setting, expandabspath
 
@@ -16,17 +16,35 @@ if os.getenv('CONFIG_TMPDIR_DIR'):
     tmpdir.dir = expandabspath(os.getenv('CONFIG_TMPDIR_DIR'))
 else:
     tmpdir.dir = tempfile.gettempdir()
-Path(tmpdir.dir).mkdir(parents=True, exist_ok=True)
+
+
+def ensure_tmpdir():
+    """Create the tmpdir, deferred until a file handler needs it"""
+    _make_dir(tmpdir.dir)
+
+
+@lru_cache
+def _make_dir(path):
+    """Once per path, repeat configure_logging calls skip the syscalls
+    an existing dir (the usual case) costs a single stat
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path, exist_ok=True)
+
 
 # Syslog
 syslog = Setting()
 syslog.host = os.getenv('CONFIG_SYSLOG_HOST')
-syslog.port = os.getenv('CONFIG_SYSLOG_PORT')
+syslog.port = None
+if os.getenv('CONFIG_SYSLOG_PORT', '').strip().isdigit():  # malformed is treated as unset
+    syslog.port = int(os.getenv('CONFIG_SYSLOG_PORT'))
 
 # TLS Syslog
 tlssyslog = Setting()
 tlssyslog.host = os.getenv('CONFIG_TLSSYSLOG_HOST')
-tlssyslog.port = os.getenv('CONFIG_TLSSYSLOG_PORT')
+tlssyslog.port = None
+if os.getenv('CONFIG_TLSSYSLOG_PORT', '').strip().isdigit():  # malformed is treated as unset
+    tlssyslog.port = int(os.getenv('CONFIG_TLSSYSLOG_PORT'))
 tlssyslog.dir = None
 if os.getenv('CONFIG_TLSSYSLOG_DIR'):
     tlssyslog.dir = expandabspath(os.getenv('CONFIG_TLSSYSLOG_DIR'))
@@ -35,3 +53,4 @@ if os.getenv('CONFIG_TLSSYSLOG_DIR'):
 log = Setting()
 log.modules.extra = os.getenv('CONFIG_LOG_MODULES_EXTRA', '')
 log.modules.ignore = os.getenv('CONFIG_LOG_MODULES_IGNORE', '')
+log.reverse_dns = 'CONFIG_LOG_REVERSE_DNS' in os.environ
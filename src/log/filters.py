@@ -1,5 +1,7 @@
 import logging
 import socket
+import threading
+import time
 
 __all__ = [
     'MachineFilter',
@@ -8,11 +10,23 @@ __all__ = [
     ]
 
 
+_HOSTNAME = socket.gethostname()
+
+
 class MachineFilter(logging.Filter):
     """Simple filter by socket hostname
+    hostname is looked up once per process, call `refresh` if it changes
     """
+    def __init__(self, name=''):
+        super().__init__(name)
+        self.machine = _HOSTNAME
+
+    def refresh(self):
+        global _HOSTNAME
+        _HOSTNAME = self.machine = socket.gethostname()
+
     def filter(self, record):
-        record.machine = socket.gethostname()
+        record.machine = self.machine
         return True
 
 
@@ -25,19 +39,49 @@ class PreambleFilter(logging.Filter):
         self.cmd_args = args
         self.cmd_setup = setup
         self._success, self._failure = statuses
-        self.cmd_status = self._success
+        self._failed = False
         self.failno = failno
+        self._preamble = {'cmd_app': app, 'cmd_args': args, 'cmd_setup': setup}
+
+    @property
+    def cmd_status(self):
+        """Sticky: once a record at failno is seen we stay failed"""
+        return self._failure if self._failed else self._success
 
     def filter(self, record):
-        record.cmd_app = self.cmd_app
-        record.cmd_args = self.cmd_args
-        record.cmd_setup = self.cmd_setup
+        record.__dict__.update(self._preamble)
         if record.levelno >= self.failno:
-            self.cmd_status = self._failure
+            self._failed = True
         record.cmd_status = self.cmd_status
         return True
 
 
+_RESOLVE_TTL = 300
+_RESOLVE_MAX = 4096
+_resolved = {}
+_resolved_lock = threading.Lock()
+
+
+def _resolve(ipaddr):
+    """Reverse lookup of an ip address, cached per address for
+    _RESOLVE_TTL seconds, oldest entries evicted past _RESOLVE_MAX
+    """
+    now = time.monotonic()
+    cached = _resolved.get(ipaddr)
+    if cached is not None and cached[1] > now:
+        return cached[0]
+    try:
+        hostname, _ = socket.getnameinfo((ipaddr, 0), socket.NI_NAMEREQD)
+    except OSError:
+        hostname = ipaddr
+    with _resolved_lock:
+        _resolved.pop(ipaddr, None)
+        while len(_resolved) >= _RESOLVE_MAX:
+            del _resolved[next(iter(_resolved))]
+        _resolved[ipaddr] = (hostname, now + _RESOLVE_TTL)
+    return hostname
+
+
 class WebServerFilter(logging.Filter):
     """Create a logging.Filter with wsgi webserver context info
 
@@ -50,22 +94,24 @@ class WebServerFilter(logging.Filter):
     >>> ip_fn = lambda: flask.request.remote_addr  # doctest: +SKIP
     >>> user_fn = lambda: flask.session.get('user')  # doctest: +SKIP
     >>> handler.addFilter(WebServerFilter(ip_fn, user_fn))  # doctest: +SKIP
+
+    reverse dns is a blocking lookup on the request thread (cached per ip
+    for five minutes), so it is off by default and the raw ip is logged,
+    see CONFIG_LOG_REVERSE_DNS
+
+    >>> handler.addFilter(WebServerFilter(ip_fn, user_fn, resolve_hostname=True))  # doctest: +SKIP
     """
 
-    def __init__(self, ip_fn=lambda: '', user_fn=lambda: ''):
+    def __init__(self, ip_fn=lambda: '', user_fn=lambda: '', resolve_hostname=False):
         self.ip_fn = ip_fn
         self.user_fn = user_fn
+        self.resolve_hostname = resolve_hostname
 
     def filter(self, record):
         ipaddr = self.ip_fn() or ''
-        if not ipaddr:
-            record.ip = ipaddr
-        else:
-            try:
-                hostname, aliases, _ = socket.gethostbyaddr(ipaddr)
-            except OSError:
-                hostname = ipaddr
-            record.ip = hostname
+        if ipaddr and self.resolve_hostname:
+            ipaddr = _resolve(ipaddr)
+        record.ip = ipaddr
         record.user = self.user_fn() or ''
         return True
 
@@ -1,39 +1,39 @@
 """TODO:
 - Hander: 'twd_mail' - using defer() in the handler
 """
-import copy
+import gzip
+import http.client
 import logging
-import platform
+import os
+import queue
 import smtplib
 import sys
+import threading
+import time
 import urllib.error
 import urllib.parse
-import urllib.request
+from base64 import b64encode
 from contextlib import closing, suppress
-from email import encoders
-from email.mime.base import MIMEBase
+from email.message import EmailMessage
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import formatdate
-from functools import wraps
-from logging.handlers import HTTPHandler, SMTPHandler
-
-import mailchimp_transactional as MailchimpTransactional
+from functools import cached_property, lru_cache, wraps
+from logging.handlers import HTTPHandler, QueueHandler, QueueListener, SMTPHandler
+from string import Template
 
 from libb import stream_is_tty
-from log.colors import choose_color_ansi, choose_color_windows, set_color
+from log.colors import IS_WINDOWS, choose_color_ansi, choose_color_windows, set_color
 from log.filters import PreambleFilter
 
 with suppress(ImportError):
-    from twisted.internet import reactor
-    from twisted.internet.defer import Deferred
-    from twisted.internet.ssl import SSL, ClientContextFactory
-    from twisted.mail.smtp import ESMTPSenderFactory
+    from twisted.internet.threads import deferToThread
 
 with suppress(ImportError):
-    import boto.sns
+    import boto3
 
 __all__ = [
+    'BackgroundQueueHandler',
     'BufferedColoredSMTPHandler',
     'ColoredHandler',
     'ColoredMandrillHandler',
@@ -47,33 +47,33 @@ __all__ = [
     'SNSHandler',
     ]
 
+_choose_color = choose_color_windows if IS_WINDOWS else choose_color_ansi
+
+# html color indexed by level bucket (levelno // 10), used by ColoredHandler
+_HTML_COLORS = ('#000', '#D0D2C4', '#228B22', '#DAA520', '#EE0000', '#EE0000')
+_HTML_MAX = len(_HTML_COLORS) - 1
+_HTML_PRE = tuple(f'<pre style="color:{color};">' for color in _HTML_COLORS)
+
 
 def colorize(f):
     """This decorator assumes logging handler with stream
     converts stream to colored output, cross-platform
     """
     @wraps(f)
-    def wrapper(*args):
-        logger = args[0]
-        record = copy.copy(args[1])
-        other_args = args[2:] if len(args) > 2 else []
-        levelno = record.levelno
+    def wrapper(logger, record, *other_args):
         if not logger.is_tty:  # no access to terminal
             return f(logger, record, *other_args)
-        if 'Win' in platform.system():
-            color = choose_color_windows(levelno)
-        else:
-            color = choose_color_ansi(levelno)
-        with set_color(color, stream=logger.stream):
+        with set_color(_choose_color(record.levelno), stream=logger.stream):
             return f(logger, record, *other_args)
     return wrapper
 
 
 class NonBufferedFileHandler(logging.FileHandler):
     """Non-buffered version of the standard FileHandler
-    closing and reopening the file for each emit
+    the file is opened once with O_APPEND and each record is handed to the
+    kernel with os.write, nothing is left in a python buffer
     http://www.python.org/dev/peps/pep-3116/
-    adds a preamble if PreambleFilter is enabled
+    writes a preamble before the first record if PreambleFilter is enabled
     """
 
     def __init__(self, filename, mode='a', encoding=None, delay=0):
@@ -86,16 +86,47 @@ class NonBufferedFileHandler(logging.FileHandler):
                          '** Args:  %(cmd_args)s\n'
                          '** Setup: %(cmd_setup)s\n'
                          '***********************\n')
+        self._preamble_tmpl = Template(self.preamble.replace('%(', '${').replace(')s', '}'))
+        self._has_preamble = False
+        self._preamble_written = False
+
+    def _open(self):
+        flags = os.O_WRONLY | os.O_CREAT
+        flags |= os.O_TRUNC if 'w' in self.mode else os.O_APPEND
+        fd = os.open(self.baseFilename, flags, 0o666)  # umask applies, as with open()
+        return open(fd, self.mode, encoding=self.encoding, errors=self.errors)
+
+    def addFilter(self, filter):
+        super().addFilter(filter)
+        self._has_preamble = any(isinstance(f, PreambleFilter) for f in self.filters)
+
+    def removeFilter(self, filter):
+        super().removeFilter(filter)
+        self._has_preamble = any(isinstance(f, PreambleFilter) for f in self.filters)
 
     def emit(self, record):
-        if self.stream:
-            # calling close() more than once is allowed
-            self.stream.close()
-        with self._open() as handle:
-            self.stream = handle
-            if PreambleFilter in self.filters:
-                self.stream.write(self.preamble % record)
-            super().emit(record)
+        """Called under the handler lock, the preamble goes out with the
+        first record
+        """
+        try:
+            chunk = self.format(record) + self.terminator
+            if self._has_preamble and not self._preamble_written:
+                self._preamble_written = True
+                chunk = self._preamble_tmpl.safe_substitute(record.__dict__) + chunk
+            self._write(chunk)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+    def _write(self, data):
+        """Encode and hand the data straight to the O_APPEND fd"""
+        if self.stream is None:
+            self.stream = self._open()
+        fd = self.stream.fileno()
+        buf = memoryview(data.encode(self.stream.encoding, self.stream.errors))
+        while buf:
+            buf = buf[os.write(fd, buf):]
 
 
 class ColoredStreamHandler(logging.StreamHandler):
@@ -104,19 +135,26 @@ class ColoredStreamHandler(logging.StreamHandler):
 
     def __init__(self):
         super().__init__()
+        self.refresh_tty()
 
-    @property
-    def is_tty(self):
-        """No need to colorize output to other processes
-        """
-        return stream_is_tty(self.stream)
+    def setStream(self, stream):
+        result = super().setStream(stream)
+        self.refresh_tty()
+        return result
+
+    def refresh_tty(self):
+        """Check the stream once rather than per record, called again by
+        `setStream`; assign `self.stream` directly and call this yourself
 
-    @property
-    def std_or_stderr(self):
-        """We only want to do this if we get fileno eq to stdout/err
+        is_tty: no need to colorize output to other processes
+        std_or_stderr: the stream's fileno eq to stdout/err
         """
-        fileno = getattr(self.stream, 'fileno', None)
-        return fileno and fileno() in {sys.stdout.fileno(), sys.stderr.fileno()}
+        self.is_tty = stream_is_tty(self.stream)
+        try:
+            fileno = self.stream.fileno()
+            self.std_or_stderr = fileno in {sys.stdout.fileno(), sys.stderr.fileno()}
+        except (AttributeError, OSError, ValueError):
+            self.std_or_stderr = False
 
     @colorize
     def emit(self, record):
@@ -134,23 +172,33 @@ class ColoredHandler:
         return subject
 
     def _format_record(self, record):
-        color = self._choose_color_html(record.levelno)
         text = self.format(record)
-        html = f'<pre style="color:{color};">{text}</pre>'
+        html = f'{self._html_pre(record.levelno)}{text}</pre>'
         return text, html
 
-    def _choose_color_html(self, levelno):
-        if levelno >= 40:
-            color = '#EE0000'
-        elif levelno >= 30:
-            color = '#DAA520'
-        elif levelno >= 20:
-            color = '#228B22'
-        elif levelno >= 10:
-            color = '#D0D2C4'
-        else:
-            color = '#000'
-        return color
+    def _html_pre(self, levelno):
+        """Opening colored <pre> tag for the level, prebuilt per color"""
+        return _HTML_PRE[min(max(levelno, 0) // 10, _HTML_MAX)]
+
+
+class _FlushTimerMixin:
+    """Mixin for buffering handlers, flushes a partial buffer from a timer
+    started by the first record buffered since the last flush
+    """
+    _timer = None
+
+    def _start_flush_timer(self, interval):
+        """No-op without an interval or with a timer already pending"""
+        if interval and self._timer is None:
+            self._timer = threading.Timer(interval, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _cancel_flush_timer(self):
+        """Call from flush under the handler lock"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
 
 
 class ColoredSMTPHandler(ColoredHandler, SMTPHandler):
@@ -158,30 +206,53 @@ class ColoredSMTPHandler(ColoredHandler, SMTPHandler):
 
     def __init__(self, *args, **kwargs):
         self.ssl = kwargs.pop('ssl', False)
+        self.max_msgs_per_conn = kwargs.pop('max_msgs_per_conn', 5000)
+        self.max_idle = kwargs.pop('max_idle', 100)
         super().__init__(*args, **kwargs)
+        self._to_header = ','.join(self.toaddrs)
+        self._smtp = None
+        self._smtp_msgs = 0
+        self._smtp_deadline = 0.0
 
     def emit(self, record):
+        if not self.toaddrs:  # nobody to send to, skip the formatting
+            return
         try:
             msg = self._build_html_msg(record)
             text, html = self._format_record(record)
             html = f'<html><head></head><body>{html}</body></html>'
             msg.attach(MIMEText(text, 'text'))
             msg.attach(MIMEText(html, 'html'))
-            self._send_html_msg(msg.as_string())
+            self._send_html_msg(msg)
         except (KeyboardInterrupt, SystemExit):
             raise
         except:
             self.handleError(record)
 
-    def _build_html_msg(self, record):
+    def _build_html_msg(self, record, date=None):
         msg = MIMEMultipart('alternative')
         msg['Subject'] = self.getSubject(record)
         msg['From'] = self.fromaddr
-        msg['To'] = ','.join(self.toaddrs)
-        msg['Date'] = formatdate()
+        msg['To'] = self._to_header
+        msg['Date'] = date or formatdate()
         return msg
 
-    def _send_html_msg(self, msg):
+    def _get_smtp(self):
+        """Reuse the cached session while the server still answers NOOP,
+        otherwise connect (and starttls/login) once for the next sends
+        ... sessions are recycled after max_msgs_per_conn messages or
+        max_idle seconds without a send (most servers drop idle clients)
+        """
+        if self._smtp is not None and (self._smtp_msgs >= self.max_msgs_per_conn
+                                       or time.monotonic() > self._smtp_deadline):
+            self._close_smtp()
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._close_smtp()
         port = self.mailport
         if not port:
             port = smtplib.SMTP_PORT
@@ -195,27 +266,56 @@ class ColoredSMTPHandler(ColoredHandler, SMTPHandler):
             smtp.ehlo()
         if self.username:
             smtp.login(self.username, self.password)
-        smtp.sendmail(self.fromaddr, self.toaddrs, msg)
-        smtp.quit()
+        self._smtp = smtp
+        self._smtp_msgs = 0
+        self._smtp_deadline = time.monotonic() + self.max_idle
+        return smtp
+
+    def _close_smtp(self):
+        if self._smtp is None:
+            return
+        with suppress(smtplib.SMTPException, OSError):
+            self._smtp.quit()
+        self._smtp = None
+
+    def _send_html_msg(self, msg):
+        """Send on the cached session, reconnecting and retrying once if
+        the server hung up on it; `send_message` flattens the message
+        straight to bytes for the socket
+        """
+        for retry in (True, False):
+            smtp = self._get_smtp()
+            try:
+                smtp.send_message(msg, self.fromaddr, self.toaddrs)
+                break
+            except smtplib.SMTPServerDisconnected:
+                self._close_smtp()
+                if not retry:
+                    raise
+            except (smtplib.SMTPException, OSError):
+                self._close_smtp()
+                raise
+        self._smtp_msgs += 1
+        self._smtp_deadline = time.monotonic() + self.max_idle
+
+    def close(self):
+        """Quit the cached smtp session"""
+        self._close_smtp()
+        super().close()
 
 
 class TwistedSMTPHandler:
-    """Twisted mixin to make a deferred version of our SMTPHandlers"""
+    """Twisted mixin to make a deferred version of our SMTPHandlers
+    sends run in the reactor threadpool over the handler's cached smtp
+    session, serialized on the handler lock
+    """
 
     def _send_html_msg(self, msg):
-        port = self.mailport
-        if not port:
-            port = smtplib.SMTP_PORT
-        dfd = Deferred()
-        kw = {}
-        if self.ssl:
-            kw['contextFactory'] = ClientContextFactory()
-            kw['contextFactory'].method = SSL.SSLv3_METHOD
-        senderFactory = ESMTPSenderFactory(self.username, self.password,
-                                           self.fromaddr, self.toaddrs, msg,
-                                           dfd, **kw)
-        reactor.connectTCP(self.mailhost, port, senderFactory)
-        return dfd
+        return deferToThread(self._send_html_msg_locked, msg)
+
+    def _send_html_msg_locked(self, msg):
+        with self.lock:
+            return super()._send_html_msg(msg)
 
 
 class ScreenshotColoredSMTPHandler(ColoredSMTPHandler):
@@ -229,16 +329,16 @@ class ScreenshotColoredSMTPHandler(ColoredSMTPHandler):
         self.webdriver = kwargs.pop('webdriver', None)
         super().__init__(*args, **kwargs)
 
-    def _build_html_msg(self, record):
-        msg = MIMEMultipart()
+    def _build_html_msg(self, record, date=None):
+        msg = EmailMessage()
         msg['Subject'] = self.getSubject(record)
         msg['From'] = self.fromaddr
-        msg['To'] = ','.join(self.toaddrs)
-        msg['Date'] = formatdate()
+        msg['To'] = self._to_header
+        msg['Date'] = date or formatdate()
         return msg
 
     def emit(self, record):
-        if self.webdriver is None:
+        if self.webdriver is None or not self.toaddrs:
             return
         name = 'screenshot.png'
         src_name = 'page_source.txt'
@@ -248,78 +348,94 @@ class ScreenshotColoredSMTPHandler(ColoredSMTPHandler):
             url = self.webdriver.current_url
             lk = f'<div><a href="{url}">{url}</a></div>'
             html = f'<html><head></head><body>{html}{lk}<img src="cid:{name}"/></body></html>'
-            msg.attach(MIMEText(text, 'text'))
-            msg.attach(MIMEText(html, 'html'))
-            img = MIMEBase('image', 'png')
-            img.set_payload(self.webdriver.get_screenshot_as_base64())
-            img.add_header('Content-ID', name)
-            img.add_header('Content-Disposition', 'attachment', filename=name)
-            msg.attach(img)
-            src = MIMEBase('application', 'octet-stream')
-            src.set_payload(self.webdriver.page_source)
-            try:
-                encoders.encode_base64(src)
-            except UnicodeEncodeError:
-                page_source_utf = self.webdriver.page_source.encode('utf-8')
-                src.set_payload(page_source_utf)
-                encoders.encode_base64(src)
-            src.add_header('Content-ID', src_name)
-            src.add_header('Content-Disposition', 'attachment', filename=src_name)
-            msg.attach(src)
-            self._send_html_msg(msg.as_string())
+            msg.set_content(text)
+            msg.add_alternative(html, subtype='html')
+            msg.add_attachment(self.webdriver.get_screenshot_as_png(),
+                               maintype='image', subtype='png',
+                               filename=name, cid=name)
+            msg.add_attachment(self.webdriver.page_source.encode('utf-8', errors='replace'),
+                               maintype='application', subtype='octet-stream',
+                               filename=src_name, cid=src_name)
+            self._send_html_msg(msg)
         except (KeyboardInterrupt, SystemExit):
             raise
         except:
             self.handleError(record)
 
 
-class BufferedColoredSMTPHandler(ColoredSMTPHandler):
+class BufferedColoredSMTPHandler(_FlushTimerMixin, ColoredSMTPHandler):
     """Get as much of a job log as possible, esp. useful for distributed jobs"""
 
     def __init__(self, *args, **kwargs):
         capacity = kwargs.pop('capacity', 1024)
         flushLevel = kwargs.pop('flushLevel', logging.ERROR)
+        records_per_msg = kwargs.pop('records_per_msg', None)
+        if kwargs.pop('batch_individual', False):
+            records_per_msg = 1
+        flush_interval = kwargs.pop('flush_interval', None)
         super().__init__(*args, **kwargs)
         self.capacity = capacity
         self.flushLevel = flushLevel
+        self.records_per_msg = records_per_msg
+        self.flush_interval = flush_interval
         self.buffer = []
 
     def shouldFlush(self, record):
         """No longer flushing if we reach flushLevel
         ... otherwise we get bombarded with emails
+        flush at capacity, a partial buffer is sent by a timer
+        flush_interval seconds (if set) after its first record
         """
         return len(self.buffer) >= self.capacity
 
     def emit(self, record):
+        if not self.toaddrs:  # nobody to send to, nothing to buffer
+            return
         try:
             self.buffer.append(record)
             if self.shouldFlush(record):
                 self.flush()
+            else:
+                self._start_flush_timer(self.flush_interval)
         except (KeyboardInterrupt, SystemExit):
             raise
         except:
             self.handleError(record)
 
     def flush(self):
-        if not self.buffer:
-            return
-        try:
-            msg = self._build_html_msg(self.buffer[-1])  # last msg success/fail
-            formatted = [self._format_record(_) for _ in self.buffer]
-            text, html = list(zip(*formatted))
-            text = '\n'.join(text)
-            html = '<html><head></head><body>{}</body></html>'\
-            .format('\n'.join(html))
-            msg.attach(MIMEText(text, 'text'))
-            msg.attach(MIMEText(html, 'html'))
-            self._send_html_msg(msg.as_string())
-            self.buffer = []
-        except (KeyboardInterrupt, SystemExit):
-            raise
-        except:
-            for record in self.buffer:
-                self.handleError(record)
-            self.buffer = []
+        """Send the buffer as one email, or one per `records_per_msg`
+        records (`batch_individual` for one email per record), all over
+        the same smtp session; a dropped session is reconnected and the
+        flush resumes from the first unsent record
+        """
+        with self.lock:
+            self._cancel_flush_timer()
+            if not self.buffer:
+                return
+            step = self.records_per_msg or len(self.buffer)
+            date = formatdate()  # one flush, one timestamp
+            try:
+                while self.buffer:
+                    records = self.buffer[:step]
+                    msg = self._build_html_msg(records[-1], date)  # last msg success/fail
+                    text, html = [], []
+                    for record in records:
+                        line = self.format(record)
+                        text.append(line)
+                        html.append(f'{self._html_pre(record.levelno)}{line}</pre>')
+                    text = '\n'.join(text)
+                    html = '<html><head></head><body>{}</body></html>'\
+                    .format('\n'.join(html))
+                    msg.attach(MIMEText(text, 'text'))
+                    msg.attach(MIMEText(html, 'html'))
+                    self._send_html_msg(msg)
+                    del self.buffer[:step]
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                for record in self.buffer:
+                    self.handleError(record)
+                self.buffer.clear()
 
     def close(self):
         """Final flush before closing the handler"""
@@ -332,23 +448,33 @@ class ColoredMandrillHandler(ColoredHandler, logging.Handler):
 
     def __init__(self, apikey, fromaddr, toaddrs, subject):
         logging.Handler.__init__(self)
-        self.api = MailchimpTransactional.Client(apikey)
+        self._apikey = apikey
         self.fromaddr = fromaddr
         if isinstance(toaddrs, str):
             toaddrs = [toaddrs]
-        self.toaddrs = [{'email': email} for email in toaddrs]
+        self.toaddrs = [{'email': email} for email in toaddrs if email]
         self.subject = subject
+        self._base_msg = {'from_email': self.fromaddr, 'to': self.toaddrs}
+
+    @cached_property
+    def api(self):
+        """Client built on first send, importing log or configuring the
+        handler does not pay for the mailchimp package
+        """
+        import mailchimp_transactional as MailchimpTransactional
+        return MailchimpTransactional.Client(self._apikey)
 
     def emit(self, record):
-        text, html = self._format_record(record)
-        msg = {
-            'from_email': self.fromaddr,
-            'to': self.toaddrs,
-            'subject': self.getSubject(record),
-            'html': html,
-            'text': text,
-        }
+        if not self.toaddrs:  # nobody to send to, skip the formatting
+            return
         try:
+            text, html = self._format_record(record)
+            msg = {
+                **self._base_msg,
+                'subject': self.getSubject(record),
+                'html': html,
+                'text': text,
+            }
             self.api.messages.send({'message':msg})
         except (KeyboardInterrupt, SystemExit):
             raise
@@ -364,10 +490,10 @@ class ScreenshotColoredMandrillHandler(ColoredMandrillHandler):
         super().__init__(apikey, fromaddr, toaddrs, subject, **kw)
 
     def emit(self, record):
-        if self.webdriver is None:
+        if self.webdriver is None or not self.toaddrs:
             return
         name = 'screenshot.png'
-        src_name = 'page_source.txt'
+        src_name = 'page_source.html.gz'
         try:
             text, html = self._format_record(record)
             url = self.webdriver.current_url
@@ -378,14 +504,15 @@ class ScreenshotColoredMandrillHandler(ColoredMandrillHandler):
                 'name': name,
                 'type': 'image/png',
                 }
+            # html compresses several times over, a smaller payload to encode and post
+            page_source = gzip.compress(self.webdriver.page_source.encode('utf-8'), compresslevel=1)
             src = {
-                'content': self.webdriver.page_source,
+                'content': b64encode(page_source).decode('ascii'),
                 'name': src_name,
-                'type': 'text/plain',
+                'type': 'application/gzip',
                 }
             msg = {
-                'from_email': self.fromaddr,
-                'to': self.toaddrs,
+                **self._base_msg,
                 'subject': self.getSubject(record),
                 'html': html,
                 'text': text,
@@ -399,51 +526,264 @@ class ScreenshotColoredMandrillHandler(ColoredMandrillHandler):
             self.handleError(record)
 
 
-class URLHandler(HTTPHandler):
+class URLHandler(_FlushTimerMixin, HTTPHandler):
     """HTTPHandler with HTTPS a SumoLogic headers
+    keeps one http(s) connection open across emits
+    posts newline-delimited batches of `capacity` records, a partial batch
+    is sent after `max_interval` seconds (if set) or on flush/close
     """
 
-    def __init__(self, host, url, method):
-        super().__init__()
-        self.host = host
-        self.url = url
-        self.method = method
+    def __init__(self, host, url, method, capacity=1, max_interval=None):
+        parts = urllib.parse.urlsplit(host if '//' in host else f'//{host}')
+        super().__init__(parts.netloc, url, method, secure=parts.scheme == 'https')
+        self.capacity = capacity
+        self.max_interval = max_interval
+        self.buffer = []
+        self._conn = None
+
+    def _get_connection(self):
+        if self._conn is None:
+            self._conn = self.getConnection(self.host, self.secure)
+        return self._conn
+
+    def _close_connection(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _post(self, body):
+        """Send on the kept-alive connection, reconnecting and retrying
+        once if the server closed it while idle
+        an error status raises HTTPError (as urlopen did), not retried
+        """
+        for retry in (True, False):
+            conn = self._get_connection()
+            try:
+                conn.request(self.method, self.url, body=body,
+                             headers={'Content-Type': 'text/plain; charset=utf-8'})
+                with closing(conn.getresponse()) as resp:
+                    _ = resp.read()
+                break
+            except (ConnectionError, http.client.HTTPException):
+                self._close_connection()
+                if not retry:
+                    raise
+        if resp.status >= 400:
+            raise urllib.error.HTTPError(self.url, resp.status, resp.reason, resp.headers, None)
 
     def emit(self, record):
         try:
-            data = self.format(record)
-            with closing(urllib.request.urlopen(self.host+self.url, data)) as req:
-                _ = req.read()
+            self.buffer.append((record, self.format(record)))
+            if len(self.buffer) >= self.capacity:
+                self.flush()
+            else:
+                self._start_flush_timer(self.max_interval)
         except (KeyboardInterrupt, SystemExit):
             raise
         except:
             self.handleError(record)
 
+    def flush(self):
+        with self.lock:
+            self._cancel_flush_timer()
+            if not self.buffer:
+                return
+            records, lines = zip(*self.buffer)
+            self.buffer.clear()
+            try:
+                self._post('\n'.join(lines).encode('utf-8'))
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                self._close_connection()
+                for record in records:
+                    self.handleError(record)
+
+    def close(self):
+        self.flush()
+        self._close_connection()
+        super().close()
 
-class SNSHandler(ColoredHandler, logging.Handler):
-    """Boto SNS Handler (TODO: improve with ColoredHandler calls)
+
+@lru_cache
+def _sns_client(region_name):
+    """One SNS client per region, shared by every SNSHandler
+    boto3 clients are thread safe, building one loads credentials and endpoints
+    """
+    return boto3.client('sns', region_name=region_name)
+
+
+class SNSHandler(_FlushTimerMixin, ColoredHandler, logging.Handler):
+    """Boto3 SNS Handler (TODO: improve with ColoredHandler calls)
+    records are published in batches of up to 10 (the SNS limit), a batch is
+    sent when full, on a record at flushLevel or above, `max_interval`
+    seconds after its first record (None to wait), and on flush/close
+    publish is a blocking https call, wrap in `BackgroundQueueHandler`
+    to keep it off the logging thread
     """
 
-    def __init__(self, topic_arn, *args, **kwargs):
+    def __init__(self, topic_arn, *args, capacity=10, flushLevel=logging.ERROR,
+                 max_interval=5.0, **kwargs):
         super().__init__(*args, **kwargs)
-        try:
-            region_name = topic_arn.split(':')[3]
-            self.sns_connection = boto.sns.connect_to_region(region_name)
-            self.topic_arn = topic_arn
-        except:
-            # see CONFIG_SNSLOG_TOPIC_ARN
-            # check boto installed
-            pass
+        self.capacity = min(capacity, 10)
+        self.flushLevel = flushLevel
+        self.max_interval = max_interval
+        self.buffer = []
+        self._subjects = {}
+        self.topic_arn = topic_arn
+
+    @cached_property
+    def sns_client(self):
+        """Client built on first publish (see CONFIG_SNSLOG_TOPIC_ARN),
+        errors such as a bad arn or boto3 missing go to handleError
+        """
+        region_name = self.topic_arn.split(':')[3]
+        return _sns_client(region_name)
+
+    def _subject(self, record):
+        """SNS subjects are ascii and under 100 characters
+        cached per (logger, level), reset if it grows past 256 entries
+        """
+        key = record.name, record.levelname
+        subject = self._subjects.get(key)
+        if subject is None:
+            if len(self._subjects) >= 256:
+                self._subjects.clear()
+            subject = f'{record.name}:{record.levelname}'
+            subject = subject.encode('ascii', errors='ignore')[:99].decode('ascii')
+            self._subjects[key] = subject
+        return subject
+
+    def _publish(self, entries):
+        """One publish_batch call, single publishes for older boto3
+        returns {index: failure} for entries SNS did not accept
+        """
+        if len(entries) == 1 or not hasattr(self.sns_client, 'publish_batch'):
+            for entry in entries:
+                self.sns_client.publish(TopicArn=self.topic_arn, **entry)
+            return {}
+        response = self.sns_client.publish_batch(
+            TopicArn=self.topic_arn,
+            PublishBatchRequestEntries=[{'Id': str(i), **entry}
+                                        for i, entry in enumerate(entries)])
+        return {int(failure['Id']): failure for failure in response.get('Failed', ())}
 
     def emit(self, record):
         try:
-            subject = f'{record.name}:{record.levelname}'
-            self.sns_connection.publish(
-                self.topic_arn,
-                self.format(record),
-                subject=subject.encode('ascii', errors='ignore')[:99])
+            entry = {'Message': self.format(record), 'Subject': self._subject(record)}
+            self.buffer.append((record, entry))
+            if len(self.buffer) >= self.capacity or record.levelno >= self.flushLevel:
+                self.flush()
+            else:
+                self._start_flush_timer(self.max_interval)
         except (KeyboardInterrupt, SystemExit):
             raise
+        except:
+            self.handleError(record)
+
+    def flush(self):
+        """Publish the buffer, entries SNS failed on its side (SenderFault
+        false) are retried once, the rest are passed to handleError
+        """
+        with self.lock:
+            self._cancel_flush_timer()
+            if not self.buffer:
+                return
+            records, entries = zip(*self.buffer)
+            self.buffer.clear()
+            try:
+                failed = self._publish(entries)
+                retry = [i for i, failure in failed.items() if not failure.get('SenderFault')]
+                if retry:
+                    refailed = self._publish([entries[i] for i in retry])
+                    for j, i in enumerate(retry):
+                        if j in refailed:
+                            failed[i] = refailed[j]
+                        else:
+                            del failed[i]
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                for record in records:
+                    self.handleError(record)
+                return
+            self._report_failures(records, failed)
+
+    def _report_failures(self, records, failed):
+        """handleError for each record SNS rejected, under one exception
+        carrying the SNS codes and messages
+        """
+        if not failed:
+            return
+        reasons = '; '.join(f"{failure.get('Code')} {failure.get('Message')}"
+                            for failure in failed.values())
+        try:
+            raise RuntimeError(f'SNS publish failed: {reasons}')
+        except RuntimeError:
+            for i in failed:
+                self.handleError(records[i])
+
+    def close(self):
+        """Final flush before closing the handler"""
+        self.flush()
+        super().close()
+
+
+class _QueueListener(QueueListener):
+    """Blocking sentinel put, the bounded queue may be full on stop"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """Run a slow (network) handler on a background thread
+    - emit returns after a queue put, the wrapped handler is driven by a QueueListener
+    - the handler's level and filters move to the front so context filters
+      (machine, webserver ip/user) still run on the calling thread
+    - the queue is bounded, when full the oldest record is dropped
+    """
+
+    def __init__(self, handler, queue_size=10000):
+        super().__init__(queue.Queue(queue_size))
+        self.handler = handler
+        self.setLevel(handler.level)
+        for f in list(handler.filters):
+            self.addFilter(f)
+            handler.removeFilter(f)
+        self.dropped = 0
+        self.listener = _QueueListener(self.queue, handler, respect_handler_level=True)
+        self.listener.start()
+
+    def enqueue(self, record):
+        """Called under the handler lock, records after close are ignored"""
+        if self.listener is None:
+            return
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                with suppress(queue.Empty):
+                    self.queue.get_nowait()
+                    self.dropped += 1
+
+    def close(self):
+        """Drain the queue, then close the wrapped handler
+        listener is cleared under the lock so enqueue stops adding (and
+        cannot drop the stop sentinel), the join runs after releasing it
+        since the listener thread may log back into this front
+        the number of records dropped on a full queue is reported to stderr
+        """
+        with self.lock:
+            listener, self.listener = self.listener, None
+        if listener is not None:
+            listener.stop()
+            self.handler.close()
+            if self.dropped:
+                sys.stderr.write(f'{self.handler!r}: dropped {self.dropped} '
+                                 'records, background queue was full\n')
+        super().close()
 
 
 def _add_default_handler(logger):
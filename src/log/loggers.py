@@ -7,16 +7,30 @@ class StderrStreamLogger:
     """Patch over stderr to log print statements to INFO
     placeholders isatty and fileno mimic python stream
     stderr still accessible at stderr.__stderr__
+    a multi-line write is logged in records of up to max_lines_per_record
+    lines (None or <= 0 for no limit), or one record per line with coalesce=False
     """
 
-    def __init__(self, logger):
+    def __init__(self, logger, coalesce=True, max_lines_per_record=200):
         self.logger = logger
         self.level = logging.INFO
         self.linebuf = ''
+        self.coalesce = coalesce
+        self.max_lines_per_record = max_lines_per_record
 
     def write(self, buf):
-        for line in buf.rstrip().splitlines():
-            self.logger.log(self.level, line.rstrip())
+        if not self.logger.isEnabledFor(self.level):
+            return
+        lines = buf.rstrip().splitlines()
+        if not self.coalesce:
+            for line in lines:
+                self.logger.log(self.level, line.rstrip())
+            return
+        step = self.max_lines_per_record
+        if not step or step <= 0:
+            step = len(lines) or 1
+        for i in range(0, len(lines), step):
+            self.logger.log(self.level, '\n'.join(line.rstrip() for line in lines[i:i + step]))
 
     def isatty(self):
         return False
@@ -2,6 +2,7 @@
 """
 
 import datetime
+import importlib.util
 import logging
 import os
 import ssl
@@ -19,14 +20,12 @@ from mail import config as config_mail
 with suppress(ImportError):
     import web
 
-try:
-    import mailchimp_transactional as MailchimpTransactional
-    MAILCHIMP_ENABLED = True
-except ImportError:
-    MAILCHIMP_ENABLED = False
+# check without importing, the client is only loaded by the mandrill handler
+MAILCHIMP_ENABLED = importlib.util.find_spec('mailchimp_transactional') is not None
 
 
 __all__ = [
+    'attach_async',
     'configure_logging',
     'log_exception',
     'patch_webdriver',
@@ -36,9 +35,7 @@ __all__ = [
 
 def set_level(levelname):
     """Simple utility for setting root logging via sqla"""
-    level_names = {v: k for k, v in logging._levelToName.items()}
-    level_names['WARN'] = level_names['WARNING']
-    level = level_names[levelname.upper()]
+    level = logging._nameToLevel[levelname.upper()]  # includes WARN
     for handler in logging.root.handlers:
         handler.setLevel(level)
     logging.root.setLevel(level)
@@ -78,6 +75,7 @@ LOG_CONF = {
             'ip_fn': lambda: web.ctx.get('ip'),
             'user_fn': lambda: hasattr(web.ctx, 'session')
             and web.ctx.session.get('user'),
+            'resolve_hostname': config_log.log.reverse_dns,
             },
         'preamble': {
             '()': 'log.filters.PreambleFilter',
@@ -118,11 +116,15 @@ JOB_HANDLERS = ['job_file']
 TWD_HANDLERS = []
 SRP_HANDLERS = []
 
+# named handlers doing blocking network i/o, run behind BackgroundQueueHandler
+BACKGROUND_HANDLERS = []
+
 if MAILCHIMP_ENABLED and os.getenv('CONFIG_MANDRILL_APIKEY'):
     # named handlers
     WEB_HANDLERS.extend(['web_mail'])
     JOB_HANDLERS.extend(['job_mail'])
     SRP_HANDLERS.extend(['job_mail'])
+    BACKGROUND_HANDLERS.extend(['job_mail', 'web_mail'])
     # handler config
     LOG_CONF['handlers'].update({
         'job_mail': {
@@ -146,12 +148,13 @@ if MAILCHIMP_ENABLED and os.getenv('CONFIG_MANDRILL_APIKEY'):
             'subject': '%(machine)s %(name)s %(levelname)s',
         },
     })
-if os.getenv('CONFIG_SYSLOG_HOST') and os.getenv('CONFIG_SYSLOG_PORT'):
+if config_log.syslog.host and config_log.syslog.port:
     # named handlers
     WEB_HANDLERS.extend(['web_sysl'])
     TWD_HANDLERS.extend(['web_sysl'])
     JOB_HANDLERS.extend(['job_sysl'])
     SRP_HANDLERS.extend(['job_sysl'])
+    BACKGROUND_HANDLERS.extend(['job_sysl', 'web_sysl'])
     # handler config
     LOG_CONF['handlers'].update({
         'job_sysl': {
@@ -169,12 +172,13 @@ if os.getenv('CONFIG_SYSLOG_HOST') and os.getenv('CONFIG_SYSLOG_PORT'):
             'filters': WEB_FILTERS,
         },
     })
-if os.getenv('CONFIG_TLSSYSLOG_HOST') and os.getenv('CONFIG_TLSSYSLOG_PORT'):
+if config_log.tlssyslog.host and config_log.tlssyslog.port:
     # named handlers
     WEB_HANDLERS.extend(['web_tlssysl'])
     TWD_HANDLERS.extend(['web_tlssysl'])
     JOB_HANDLERS.extend(['job_tlssysl'])
     SRP_HANDLERS.extend(['job_tlssysl'])
+    BACKGROUND_HANDLERS.extend(['job_tlssysl', 'web_tlssysl'])
     # handler config
     LOG_CONF['handlers'].update({
         'job_tlssysl': {
@@ -184,7 +188,7 @@ if os.getenv('CONFIG_TLSSYSLOG_HOST') and os.getenv('CONFIG_TLSSYSLOG_PORT'):
             'ssl_kwargs': {
                 'cert_reqs': ssl.CERT_REQUIRED,
                 'ssl_version': ssl.PROTOCOL_TLS,
-                'ca_certs': config_log.tslsyslog.dir
+                'ca_certs': config_log.tlssyslog.dir
                 },
             'formatter': 'job_fmt',
             'filters': JOB_FILTERS,
@@ -196,7 +200,7 @@ if os.getenv('CONFIG_TLSSYSLOG_HOST') and os.getenv('CONFIG_TLSSYSLOG_PORT'):
             'ssl_kwargs': {
                 'cert_reqs': ssl.CERT_REQUIRED,
                 'ssl_version': ssl.PROTOCOL_TLS,
-                'ca_certs': config_log.tslsyslog.dir
+                'ca_certs': config_log.tlssyslog.dir
                 },
             'formatter': 'web_fmt',
             'filters': WEB_FILTERS,
@@ -261,7 +265,7 @@ SRP_CONF = {
     },
 }
 
-for mod in (config_log.log.modules.extra or '').split(','):
+for mod in filter(None, (config_log.log.modules.extra or '').split(',')):
     CMD_CONF['loggers'][mod] = CMD_CONF['loggers']['cmd']
     JOB_CONF['loggers'][mod] = JOB_CONF['loggers']['job']
     TWD_CONF['loggers'][mod] = TWD_CONF['loggers']['twd']
@@ -286,6 +290,46 @@ def class_logger(cls, enable=False):
     _logged_classes.add(cls)
 
 
+def _copy_conf(conf):
+    """Copy the nested dicts of a config so merging and filename formatting
+    leave the module presets untouched, other values (lists, callables) are shared
+    """
+    return {k: _copy_conf(v) if ismapping(v) else v for k, v in conf.items()}
+
+
+def _run_in_background(logconfig, handler_names):
+    """Swap the named handlers configured by dictConfig for one
+    BackgroundQueueHandler each, shared by every logger using them
+    """
+    wrapped = {}
+    for name in logconfig['loggers']:
+        logger = logging.getLogger(name)
+        for handler in list(logger.handlers):
+            if handler.name not in handler_names:
+                continue
+            if handler.name not in wrapped:
+                wrapped[handler.name] = BackgroundQueueHandler(handler)
+            logger.removeHandler(handler)
+            logger.addHandler(wrapped[handler.name])
+
+
+def attach_async(logger, *handlers, queue_size=10000):
+    """Add network handlers (smtp, mandrill, url, sns) to a logger behind
+    BackgroundQueueHandler fronts so callers only pay for a queue put
+    - keep console handlers synchronous, ordering matters on a tty
+    - keep screenshot handlers synchronous, the webdriver page must be
+      captured at the error (and `patch_webdriver` only sees handlers
+      attached directly)
+    - fronts are closed (queue drained) by logging.shutdown at exit
+    """
+    if isinstance(logger, str):
+        logger = logging.getLogger(logger)
+    fronts = [BackgroundQueueHandler(h, queue_size=queue_size) for h in handlers]
+    for front in fronts:
+        logger.addHandler(front)
+    return fronts
+
+
 def configure_logging(setup=None, app=None, app_args=None, level=None):
     """Configure console and file logging for any app"""
 
@@ -298,22 +342,22 @@ def configure_logging(setup=None, app=None, app_args=None, level=None):
     if level:
         set_level(level)
 
-    logconfig = LOG_CONF
+    logconfig = _copy_conf(LOG_CONF)
 
     match setup:
         case 'cmd':
-            merge_dict(logconfig, CMD_CONF)
+            merge_dict(logconfig, _copy_conf(CMD_CONF))
         case 'job':
-            merge_dict(logconfig, JOB_CONF)
+            merge_dict(logconfig, _copy_conf(JOB_CONF))
         case 'twd':
-            merge_dict(logconfig, TWD_CONF)
+            merge_dict(logconfig, _copy_conf(TWD_CONF))
         case 'web':
-            merge_dict(logconfig, WEB_CONF)
+            merge_dict(logconfig, _copy_conf(WEB_CONF))
         case 'srp':
-            merge_dict(logconfig, SRP_CONF)
+            merge_dict(logconfig, _copy_conf(SRP_CONF))
 
     if config_log.CHECKTTY and stream_is_tty(sys.stdout):
-        merge_dict(logconfig, CMD_CONF)
+        merge_dict(logconfig, _copy_conf(CMD_CONF))
 
     file_fmt = {
         'app': app or '',
@@ -327,12 +371,14 @@ def configure_logging(setup=None, app=None, app_args=None, level=None):
         for k, subd_or_file in thed.items():
             if ismapping(subd_or_file):
                 file_formatter(subd_or_file)
-            elif k in {'app', 'args', 'filename'}:
+            elif k in {'app', 'args', 'setup', 'filename'}:
                 thed[k] = subd_or_file % str_fmt
 
     file_formatter(logconfig)
 
+    config_log.ensure_tmpdir()
     dictConfig(logconfig)
+    _run_in_background(logconfig, BACKGROUND_HANDLERS)
 
 
 def log_exception(logger):
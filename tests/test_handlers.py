@@ -0,0 +1,45 @@
+import logging
+import sys
+import threading
+import time
+
+from log.handlers import BackgroundQueueHandler
+from log.loggers import StderrStreamLogger
+
+
+class FailOnce(logging.Handler):
+    """Fails its first emit after a delay, so handleError writes to
+    (patched) stderr while close() is joining the listener
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.failed = False
+        self.records = []
+
+    def emit(self, record):
+        try:
+            if not self.failed:
+                self.failed = True
+                time.sleep(0.2)
+                raise RuntimeError('boom')
+            self.records.append(record)
+        except RuntimeError:
+            self.handleError(record)
+
+
+def test_background_close_with_reentrant_stderr(monkeypatch):
+    logger = logging.getLogger('test_background_close_reentrant')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)  # StderrStreamLogger writes at INFO
+    front = BackgroundQueueHandler(FailOnce())
+    logger.addHandler(front)
+    monkeypatch.setattr(sys, 'stderr', StderrStreamLogger(logger))
+    try:
+        logger.error('first')
+        closer = threading.Thread(target=front.close, daemon=True)
+        closer.start()
+        closer.join(5)
+        assert not closer.is_alive(), 'close() deadlocked'
+    finally:
+        logger.removeHandler(front)